@@ -1,59 +1,186 @@
 from datetime import datetime, date, time, timedelta, timezone
-import os, csv, io, json
+import os, csv, io, json, tempfile
+from itertools import groupby
+from operator import itemgetter
 from pathlib import Path
 from typing import List, Optional
 
-from fastapi import FastAPI, Request, Form, status, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from fastapi import FastAPI, Request, Form, Depends, BackgroundTasks, status, HTTPException
+from fastapi.responses import HTMLResponse, ORJSONResponse, RedirectResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 
-from pydantic import BaseModel, Field
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, func, text
-from sqlalchemy.orm import sessionmaker, declarative_base
+from pydantic import BaseModel, ConfigDict, Field
+from sqlalchemy import Column, Integer, String, Date, DateTime, Text, TypeDecorator, event, func, inspect, text, select, update, or_
+from sqlalchemy.orm import declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.exc import IntegrityError
 from dotenv import load_dotenv
 import asyncio
+import logging
 import aiosmtplib
 import httpx
+import orjson
 
 load_dotenv()
 JST = timezone(timedelta(hours=9))
+log = logging.getLogger(__name__)
 
 # --- DB ---
-DB_URL = os.getenv("DATABASE_URL", "sqlite:///./reservations.db")
-engine = create_engine(DB_URL, connect_args={"check_same_thread": False} if DB_URL.startswith("sqlite") else {})
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+def _async_url(url: str) -> str:
+    """同期ドライバの URL を async ドライバに読み替える（既存の DATABASE_URL をそのまま使えるように）"""
+    if url.startswith("sqlite:///"):
+        return "sqlite+aiosqlite:///" + url[len("sqlite:///"):]
+    if url.startswith("postgresql://"):
+        return "postgresql+asyncpg://" + url[len("postgresql://"):]
+    return url
+
+DB_URL = _async_url(os.getenv("DATABASE_URL", "sqlite:///./reservations.db"))
+engine = create_async_engine(
+    DB_URL,
+    **({} if DB_URL.startswith("sqlite") else
+       dict(pool_size=10, max_overflow=10, pool_timeout=30, pool_recycle=3600, pool_pre_ping=True)),
+)
+SessionLocal = async_sessionmaker(engine, expire_on_commit=False, autoflush=False)
+
+if DB_URL.startswith("sqlite"):
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _):
+        # WAL で読み取りが書き込みを待たないように。fsync も減らす
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA mmap_size=268435456")
+        cur.execute("PRAGMA cache_size=-65536")
+        cur.close()
+
+async def get_db():
+    """リクエストごとのセッション（早期 return / 例外でも必ず閉じる）"""
+    async with SessionLocal() as db:
+        yield db
+
 Base = declarative_base()
 
+class JSTDateTime(TypeDecorator):
+    """常に JST の aware datetime を返す DateTime（SQLite は tz を保存せず naive で返るため）"""
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return value.replace(tzinfo=JST) if value.tzinfo is None else value.astimezone(JST)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        return value.replace(tzinfo=JST) if value.tzinfo is None else value.astimezone(JST)
+
 class Booking(Base):
     __tablename__ = "bookings"
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(100), nullable=False)
-    start_at = Column(DateTime(timezone=True), nullable=False)
-    end_at   = Column(DateTime(timezone=True), nullable=False)
+    start_at = Column(JSTDateTime, nullable=False)
+    end_at   = Column(JSTDateTime, nullable=False)
     minutes  = Column(Integer, nullable=False, default=30)
     status   = Column(String(20), nullable=False, default="Booked")  # Booked/Done/Cancel
     fee_jpy  = Column(Integer, nullable=True)  # Done 時に 1000
     memo     = Column(Text, nullable=True)
-    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(JST))
+    created_at = Column(JSTDateTime, default=lambda: datetime.now(JST))
+    updated_at = Column(JSTDateTime, default=lambda: datetime.now(JST), onupdate=lambda: datetime.now(JST))  # ETag 用
+
+# 読み取り専用の一覧で使う列（ORM インスタンスを組み立てず Row のまま扱う）
+BOOKING_COLS = (Booking.id, Booking.name, Booking.start_at, Booking.end_at,
+                Booking.minutes, Booking.status, Booking.fee_jpy, Booking.memo)
 
 
 class RegisteredName(Base):
     __tablename__ = "registered_names"
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(100), nullable=False, unique=True)
-    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(JST))
+    created_at = Column(JSTDateTime, default=lambda: datetime.now(JST))
 
 
-Base.metadata.create_all(engine)
+class OutboxNotification(Base):
+    """送信待ちの通知（予約と同じトランザクションで積み、全チャネルに送れたら消す）"""
+    __tablename__ = "notification_outbox"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    subject = Column(String(200), nullable=False)
+    body = Column(Text, nullable=False)
+    created_at = Column(JSTDateTime, default=lambda: datetime.now(JST))
+    # チャネルごとの送信済み時刻（送れたチャネルは再送しない）
+    line_sent_at = Column(JSTDateTime, nullable=True)
+    mail_sent_at = Column(JSTDateTime, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = Column(JSTDateTime, nullable=True)  # 失敗後のバックオフ（これより前は拾わない）
+    claimed_at = Column(JSTDateTime, nullable=True)       # 送信中のワーカーが取った時刻（複数ワーカーでの二重送信防止）
+    gave_up_at = Column(JSTDateTime, nullable=True)       # 恒久エラー / 上限到達で諦めた時刻（行は調査用に残す）
+    last_error = Column(Text, nullable=True)
 
-# 索引（初回だけ作成される）
-with engine.begin() as conn:
-    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_bookings_start_at ON bookings(start_at)"))
-    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_bookings_status_start ON bookings(status, start_at)"))
 
-app = FastAPI(title="Home Pilates Booking")
+class Feedback(Base):
+    __tablename__ = "feedbacks"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    text = Column(Text, nullable=False)
+    created_at = Column(JSTDateTime, default=lambda: datetime.now(JST))
+
+
+app = FastAPI(title="Home Pilates Booking", default_response_class=ORJSONResponse)
+
+# 索引・制約（IF NOT EXISTS 付きなので毎回流しても同じ）
+INDEX_DDLS = [
+    "CREATE INDEX IF NOT EXISTS idx_bookings_start_at ON bookings(start_at)",
+    # 月次集計（status + start_at で絞り fee_jpy を合計）をインデックスだけで完結させる
+    "CREATE INDEX IF NOT EXISTS idx_bookings_status_start_fee ON bookings(status, start_at) INCLUDE (fee_jpy)"
+    if engine.dialect.name == "postgresql" else
+    "CREATE INDEX IF NOT EXISTS idx_bookings_status_start_fee ON bookings(status, start_at, fee_jpy)",
+    "DROP INDEX IF EXISTS idx_bookings_status_start",  # 上の索引が先頭一致で代替
+    # 重複チェック（status != Cancel AND start_at < e AND end_at > s）用
+    "CREATE INDEX IF NOT EXISTS idx_bookings_status_start_end ON bookings(status, start_at, end_at)",
+    # ETag 用の max(updated_at) を毎リクエストの全件走査にしない
+    "CREATE INDEX IF NOT EXISTS idx_bookings_updated_at ON bookings(updated_at)",
+]
+if engine.dialect.name == "postgresql":
+    # 排他制約で重複をエンジン側でも弾く（SELECT〜INSERT 間の競合対策）
+    INDEX_DDLS.append("""
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'ex_bookings_no_overlap') THEN
+                ALTER TABLE bookings ADD CONSTRAINT ex_bookings_no_overlap
+                    EXCLUDE USING gist (tstzrange(start_at, end_at) WITH &&) WHERE (status <> 'Cancel');
+            END IF;
+        END $$
+    """)
+
+def _add_missing_columns(conn):
+    # create_all は既存テーブルに列を足さないので、後から増えた列だけ ALTER で追加する
+    ob = OutboxNotification.__table__.c
+    for table, cols in ((Booking.__table__, (Booking.__table__.c.updated_at,)),
+                        (OutboxNotification.__table__, (ob.line_sent_at, ob.mail_sent_at, ob.attempts,
+                                                        ob.next_attempt_at, ob.claimed_at, ob.gave_up_at, ob.last_error))):
+        have = {c["name"] for c in inspect(conn).get_columns(table.name)}
+        for col in cols:
+            if col.name not in have:
+                default = f" DEFAULT {col.server_default.arg}" if col.server_default is not None else ""
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} "
+                                  f"{col.type.compile(dialect=conn.dialect)}{default}"))
+
+@app.on_event("startup")
+async def _init_schema():
+    # DDL は起動時に 1 回だけ（import 時には DB に触らない）
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        for ddl in INDEX_DDLS:
+            await conn.execute(text(ddl))
+        await conn.execute(text("ANALYZE bookings"))
+
+@app.on_event("startup")
+async def _open_http_client():
+    # 通知用の HTTP クライアントは使い回す（毎回の TCP/TLS ハンドシェイクを省く）
+    app.state.http = httpx.AsyncClient(timeout=10, http2=True)
 
 # CORS（LAN の Streamlit から呼べるよう緩め）
 app.add_middleware(
@@ -67,89 +194,266 @@ BASE_DIR = Path(__file__).parent
 (static := BASE_DIR / "static").mkdir(exist_ok=True)
 (templates_dir := BASE_DIR / "templates").mkdir(exist_ok=True)
 app.mount("/static", StaticFiles(directory=str(static)), name="static")
-templates = Jinja2Templates(directory=str(templates_dir))
+# コンパイル済みテンプレートをディスクに残し、再起動・ワーカー fork 後の再コンパイルを省く
+(jinja_cache := Path(os.getenv("JINJA_CACHE_DIR", Path(tempfile.gettempdir()) / "jinja_cache"))).mkdir(exist_ok=True)
+templates = Jinja2Templates(env=Environment(
+    loader=FileSystemLoader(str(templates_dir)),
+    autoescape=True,
+    auto_reload=os.getenv("ENV") != "prod",  # 本番はテンプレートの stat を省く
+    bytecode_cache=FileSystemBytecodeCache(str(jinja_cache)),
+))
+
+@app.on_event("startup")
+async def _warm_templates():
+    for name in ("index.html", "new.html"):
+        templates.env.get_template(name)
 
 # --- UTIL ---
 def dt_merge(d: date, t: time) -> datetime:
-    return datetime(d.year, d.month, d.day, t.hour, t.minute, tzinfo=JST)
+    # 秒以下は切り捨て（分単位の予約）
+    return datetime.combine(d, t.replace(second=0, microsecond=0), tzinfo=JST)
 
-def _to_aware_jst(dt: datetime) -> datetime:
-    return dt if dt.tzinfo is not None else dt.replace(tzinfo=JST)
+def parse_start_time(x: str) -> time:
+    """"9" / "9:00" / "09:00:00" を受け付ける（以前の split 版と同じく 1 桁や時だけも通す）。不正なら 422"""
+    parts = x.strip().split(":")
+    try:
+        if len(parts) > 3:
+            raise ValueError(x)
+        return time(*(int(p) for p in parts))
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid start_time: {x!r}")
+
+# 通知文用の固定フォーマット（strftime のロケール処理を通さない）
+def fmt_dt(x: datetime) -> str:
+    return f"{x.year:04d}/{x.month:02d}/{x.day:02d} {x.hour:02d}:{x.minute:02d}"
+
+def fmt_t(x: datetime) -> str:
+    return f"{x.hour:02d}:{x.minute:02d}"
 
 def overlaps(s1: datetime, e1: datetime, s2: datetime, e2: datetime) -> bool:
-    s1 = _to_aware_jst(s1); e1 = _to_aware_jst(e1)
-    s2 = _to_aware_jst(s2); e2 = _to_aware_jst(e2)
-    return not (e1 <= s2 or e2 <= s1)
+    # DB から読んだ値は JSTDateTime で aware に揃っているのでそのまま比べられる
+    return s1 < e2 and s2 < e1
+
+def overlaps_ts(a0: int, a1: int, b0: int, b1: int) -> bool:
+    """エポック秒版。ループで大量に比べるときは先に int(dt.timestamp()) にしておく"""
+    return (a0 < b1) & (b0 < a1)
+
+def jst_date(col):
+    """JST での日付を SQL 側で求める式（SQLite は JST の壁時計のまま保存されている）"""
+    if engine.dialect.name == "postgresql":
+        return func.date(func.timezone("Asia/Tokyo", col), type_=Date)
+    return func.date(col, type_=Date)
+
+async def find_conflict(db, s: datetime, e: datetime) -> Optional[int]:
+    """[s, e) と重なる有効な予約の id を返す（なければ None）。判定は SQL 側でインデックスを使う"""
+    return await db.scalar(
+        select(Booking.id)
+        .where(Booking.status != "Cancel", Booking.start_at < e, Booking.end_at > s)
+        .limit(1)
+    )
+
+async def begin_booking_write(db) -> None:
+    """重なり確認〜INSERT の間に他の書き込みが割り込まないようにする。
+    SQLite は書き込みロックを先に取る（BEGIN IMMEDIATE。別プロセスの書き込みも待たせる）。Postgres は排他制約に任せる"""
+    if engine.dialect.name == "sqlite":
+        await db.execute(text("BEGIN IMMEDIATE"))
+
+async def bookings_version(db) -> str:
+    """予約テーブルの版（件数・最大 id・最終更新時刻）。作成・更新・削除のどれでも変わる"""
+    # 集計ごとに別のスカラー副問い合わせにすると、max は索引の端を 1 回見るだけで済む
+    n, max_id, last = (await db.execute(select(
+        select(func.count()).select_from(Booking).scalar_subquery(),
+        select(func.max(Booking.id)).scalar_subquery(),
+        select(func.max(Booking.updated_at)).scalar_subquery(),
+    ))).one()
+    return f"{n}-{max_id or 0}-{int(last.timestamp() * 1_000_000) if last else 0}"
+
+def not_modified(request: Request, etag: str) -> bool:
+    return etag in (t.strip() for t in request.headers.get("if-none-match", "").split(","))
+
+class PermanentNotifyError(Exception):
+    """送り直しても通らない失敗（トークン失効・宛先拒否など）"""
+
+async def _send_line(subject: str, message: str) -> None:
+    r = await app.state.http.post(
+        "https://notify-api.line.me/api/notify",
+        headers={"Authorization": f"Bearer {os.getenv('LINE_TOKEN')}"},
+        data={"message": f"{subject}\n{message}"}
+    )
+    if 400 <= r.status_code < 500 and r.status_code != 429:  # 401 = トークン失効、404/410 = サービス終了
+        raise PermanentNotifyError(f"LINE {r.status_code}: {r.text[:200]}")
+    r.raise_for_status()
 
-async def notify(subject: str, message: str):
-    # LINE Notify
+async def _send_mail(subject: str, message: str) -> None:
+    try:
+        await aiosmtplib.send(
+            message=f"Subject: {subject}\r\nTo: {os.getenv('NOTIFY_TO')}\r\nFrom: {os.getenv('SMTP_USER')}\r\n\r\n{message}",
+            hostname=os.getenv("SMTP_HOST"),
+            port=int(os.getenv("SMTP_PORT", "587")),
+            username=os.getenv("SMTP_USER"),
+            password=os.getenv("SMTP_PASS"),
+            start_tls=True,
+        )
+    except aiosmtplib.SMTPResponseException as e:
+        if e.code >= 500:  # 5xx は認証失敗・宛先拒否など恒久エラー
+            raise PermanentNotifyError(f"SMTP {e.code}: {e.message}") from e
+        raise
+
+def _channels() -> list:
+    """設定されている通知チャネル（送信済みを記録する列名, 送信関数）"""
+    ch = []
     if os.getenv("LINE_TOKEN"):
-        try:
-            async with httpx.AsyncClient(timeout=10) as client:
-                await client.post(
-                    "https://notify-api.line.me/api/notify",
-                    headers={"Authorization": f"Bearer {os.getenv('LINE_TOKEN')}"},
-                    data={"message": f"{subject}\n{message}"}
-                )
-        except Exception:
-            pass
-    # Email
+        ch.append(("line_sent_at", _send_line))
     if os.getenv("SMTP_HOST") and os.getenv("NOTIFY_TO"):
+        ch.append(("mail_sent_at", _send_mail))
+    return ch
+
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_CLAIM_TIMEOUT = timedelta(minutes=5)  # 送信中に落ちたワーカーの claim はこれを過ぎたら取り直す
+
+def _outbox_backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(60 * 2 ** (attempts - 1), 6 * 3600))  # 1 分, 2 分, 4 分 ... 最大 6 時間
+
+async def _claim(db, n_id: int, now: datetime) -> bool:
+    """行を自分の送信分として取る。条件付き UPDATE なので別ワーカー（別プロセス）と取り合っても 1 つだけ勝つ"""
+    Ob = OutboxNotification
+    res = await db.execute(
+        update(Ob).where(Ob.id == n_id, or_(Ob.claimed_at.is_(None), Ob.claimed_at < now - OUTBOX_CLAIM_TIMEOUT))
+        .values(claimed_at=now)
+    )
+    await db.commit()
+    return res.rowcount == 1
+
+async def _deliver(db, n: OutboxNotification) -> None:
+    """未送信のチャネルだけ送る。全部済めば削除、失敗はバックオフして残し、恒久エラー / 上限で諦める"""
+    errors, permanent = [], False
+    for col, send in _channels():
+        if getattr(n, col) is not None:
+            continue
         try:
-            await aiosmtplib.send(
-                message=f"Subject: {subject}\r\nTo: {os.getenv('NOTIFY_TO')}\r\nFrom: {os.getenv('SMTP_USER')}\r\n\r\n{message}",
-                hostname=os.getenv("SMTP_HOST"),
-                port=int(os.getenv("SMTP_PORT", "587")),
-                username=os.getenv("SMTP_USER"),
-                password=os.getenv("SMTP_PASS"),
-                start_tls=True,
-            )
+            await send(n.subject, n.body)
+        except PermanentNotifyError as e:
+            errors.append(str(e)); permanent = True
+            continue
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            continue
+        setattr(n, col, datetime.now(JST))
+        await db.commit()  # 送れたチャネルはすぐ記録する（このあと落ちても再送しない）
+    if not errors:
+        await db.delete(n)
+    else:
+        n.attempts += 1
+        n.last_error = "; ".join(errors)[:1000]
+        n.claimed_at = None
+        if permanent or n.attempts >= OUTBOX_MAX_ATTEMPTS:
+            n.gave_up_at = datetime.now(JST)
+            log.warning("outbox #%s: 通知を諦めました（%s 回目）: %s", n.id, n.attempts, n.last_error)
+        else:
+            n.next_attempt_at = datetime.now(JST) + _outbox_backoff(n.attempts)
+    await db.commit()
+
+_outbox_lock = asyncio.Lock()
+
+async def drain_outbox() -> None:
+    """outbox の送信期限が来た通知を古い順に送る（claim できた行だけ）"""
+    Ob = OutboxNotification
+    async with _outbox_lock:  # 同じプロセス内の BackgroundTasks と定期実行は順番に
+        async with SessionLocal() as db:
+            now = datetime.now(JST)
+            due = (await db.scalars(
+                select(Ob.id).where(
+                    Ob.gave_up_at.is_(None),
+                    or_(Ob.next_attempt_at.is_(None), Ob.next_attempt_at <= now),
+                    or_(Ob.claimed_at.is_(None), Ob.claimed_at < now - OUTBOX_CLAIM_TIMEOUT),
+                ).order_by(Ob.id)
+            )).all()
+            for n_id in due:
+                if not await _claim(db, n_id, datetime.now(JST)):
+                    continue  # 別のワーカーが送っている
+                n = await db.get(Ob, n_id)
+                if n is not None:
+                    await _deliver(db, n)
+
+OUTBOX_INTERVAL_SEC = 60
+
+async def _outbox_worker():
+    # 起動時に前回プロセスの取りこぼしを送り、その後は定期的に見に行く
+    while True:
+        try:
+            await drain_outbox()
         except Exception:
             pass
+        await asyncio.sleep(OUTBOX_INTERVAL_SEC)
 
+@app.on_event("startup")
+async def _start_outbox_worker():
+    app.state.outbox_task = asyncio.create_task(_outbox_worker())
 
-def ensure_name_registered(db, name: str) -> None:
+@app.on_event("shutdown")
+async def _stop_outbox_worker():
+    # 先に worker を止め、送信中の drain が終わるのを待ってから HTTP クライアントを閉じる
+    app.state.outbox_task.cancel()
+    try:
+        await app.state.outbox_task
+    except asyncio.CancelledError:
+        pass
+    async with _outbox_lock:
+        await app.state.http.aclose()
+
+
+def apply_status_action(b: Booking, action: str) -> bool:
+    """action（book / done / cancel）を予約に反映する。知らない action なら False"""
+    if action == "done":
+        b.status = "Done"; b.fee_jpy = b.fee_jpy or 1000
+    elif action == "cancel":
+        b.status = "Cancel"
+    elif action == "book":
+        b.status = "Booked"; b.fee_jpy = None
+    else:
+        return False
+    return True
+
+
+async def ensure_name_registered(db, name: str) -> None:
     """名前が登録されていなければ登録する"""
     if not name or not name.strip():
         return
     name = name.strip()
-    if db.query(RegisteredName).filter(RegisteredName.name == name).first():
+    if await db.scalar(select(RegisteredName.id).where(RegisteredName.name == name)):
         return
     db.add(RegisteredName(name=name))
-    db.commit()
+    await db.commit()
 
 
 # ---------------- Web画面（既存） ----------------
 @app.get("/", response_class=HTMLResponse)
-def index(request: Request, days: int = 7, booking_created: Optional[str] = None):
-    db = SessionLocal()
+async def index(request: Request, days: int = 7, booking_created: Optional[str] = None,
+                db: AsyncSession = Depends(get_db)):
     now = datetime.now(JST)
     # 今日 0:00 から表示（同日の過去も見えるように）
     start = now.replace(hour=0, minute=0, second=0, microsecond=0)
     until = start + timedelta(days=days)
-    items = (db.query(Booking)
-               .filter(Booking.start_at >= start)
-               .filter(Booking.start_at <  until)
-               .order_by(Booking.start_at.asc())
-               .all())
-    db.close()
-    for b in items:
-        b.start_at = _to_aware_jst(b.start_at)
-        b.end_at   = _to_aware_jst(b.end_at)
-    grouped = {}
-    for b in items:
-        key = b.start_at.astimezone(JST).date()
-        grouped.setdefault(key, []).append(b)
+    # 表示内容は「今日」と予約テーブルの版で決まる
+    etag = f'"{start.date()}-{await bookings_version(db)}"'
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    rows = (await db.execute(
+        select(jst_date(Booking.start_at).label("d"), *BOOKING_COLS)
+        .where(Booking.start_at >= start)
+        .where(Booking.start_at <  until)
+        .order_by(Booking.start_at.asc())
+    )).all()
+    # [(日付, [予約, ...]), ...]（日付順に並んだまま渡す）
+    grouped = [(d, list(grp)) for d, grp in groupby(rows, key=itemgetter(0))]
     return templates.TemplateResponse("index.html", {
         "request": request, "grouped": grouped, "days": days,
         "booking_created": booking_created,
-    })
+    }, headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 @app.get("/new", response_class=HTMLResponse)
-def new_form(request: Request):
-    db = SessionLocal()
-    names = [r.name for r in db.query(RegisteredName).order_by(RegisteredName.name).all()]
-    db.close()
+async def new_form(request: Request, db: AsyncSession = Depends(get_db)):
+    names = (await db.scalars(select(RegisteredName.name).order_by(RegisteredName.name))).all()
     return templates.TemplateResponse("new.html", {
         "request": request,
         "registered_names": names,
@@ -160,21 +464,20 @@ def new_form(request: Request):
 @app.post("/new")
 async def create_booking(
     request: Request,
+    background_tasks: BackgroundTasks,
     name: str = Form(...),
     date_str: str = Form(...),          # yyyy-mm-dd
     start_time: str = Form(...),        # HH:MM or HH:MM:SS
     minutes: int = Form(30),
     memo: str = Form(""),
+    db: AsyncSession = Depends(get_db),
 ):
-    d = datetime.strptime(date_str, "%Y-%m-%d").date()
-    parts = start_time.split(":"); h = int(parts[0]); m = int(parts[1]) if len(parts) > 1 else 0
-    s = dt_merge(d, time(h, m)); e = s + timedelta(minutes=minutes)
+    s = dt_merge(date.fromisoformat(date_str), parse_start_time(start_time))
+    e = s + timedelta(minutes=minutes)
 
     # 過去禁止
     if s < datetime.now(JST):
-        db = SessionLocal()
-        names = [r.name for r in db.query(RegisteredName).order_by(RegisteredName.name).all()]
-        db.close()
+        names = (await db.scalars(select(RegisteredName.name).order_by(RegisteredName.name))).all()
         return templates.TemplateResponse("new.html", {
             "request": request,
             "error": "過去の時刻には予約できません（現在以降を選んでください）。",
@@ -184,75 +487,80 @@ async def create_booking(
             "prefill_name_json": json.dumps(name),
         }, status_code=status.HTTP_400_BAD_REQUEST)
 
-    db = SessionLocal()
-    exists = db.query(Booking).filter(Booking.status != "Cancel").all()
-    for b in exists:
-        if overlaps(b.start_at, b.end_at, s, e):
-            names = [r.name for r in db.query(RegisteredName).order_by(RegisteredName.name).all()]
-            db.close()
-            return templates.TemplateResponse("new.html", {
-                "request": request,
-                "error": "同時間帯に既存の予約があるため作成できません。",
-                "prefill": {"name": name, "date_str": date_str, "start_time": start_time, "minutes": minutes, "memo": memo},
-                "registered_names": names,
-                "registered_names_json": json.dumps(names),
-                "prefill_name_json": json.dumps(name),
-            })
-    bk = Booking(name=name.strip(), start_at=s, end_at=e, minutes=minutes, memo=memo)
-    db.add(bk)
-    db.commit()
-    db.refresh(bk)
-    ensure_name_registered(db, name)
-    db.close()
-
-    subj = f"【予約】{bk.start_at.strftime('%Y/%m/%d %H:%M')} {name}"
-    body = f"{name}\n{bk.start_at.strftime('%Y/%m/%d %H:%M')} - {bk.end_at.strftime('%H:%M')}（{minutes}分）\n{memo or ''}"
-    try:
-        asyncio.get_running_loop().create_task(notify(subj, body))
-    except RuntimeError:
-        asyncio.run(notify(subj, body))
+    await begin_booking_write(db)
+    conflict = await find_conflict(db, s, e)
+    if not conflict:
+        bk = Booking(name=name.strip(), start_at=s, end_at=e, minutes=minutes, memo=memo)
+        db.add(bk)
+        db.add(OutboxNotification(
+            subject=f"【予約】{fmt_dt(s)} {name}",
+            body=f"{name}\n{fmt_dt(s)} - {fmt_t(e)}（{minutes}分）\n{memo or ''}",
+        ))
+        try:
+            await db.commit()
+        except IntegrityError:  # 排他制約（Postgres）に弾かれた＝同時作成の競合
+            conflict = True
+    if conflict:
+        await db.rollback()  # 書き込みロックをすぐ手放す
+        names = (await db.scalars(select(RegisteredName.name).order_by(RegisteredName.name))).all()
+        return templates.TemplateResponse("new.html", {
+            "request": request,
+            "error": "同時間帯に既存の予約があるため作成できません。",
+            "prefill": {"name": name, "date_str": date_str, "start_time": start_time, "minutes": minutes, "memo": memo},
+            "registered_names": names,
+            "registered_names_json": json.dumps(names),
+            "prefill_name_json": json.dumps(name),
+        })
+    await ensure_name_registered(db, name)
+    background_tasks.add_task(drain_outbox)
 
     return RedirectResponse("/?booking_created=1", status_code=status.HTTP_303_SEE_OTHER)
 
 @app.post("/booking/{bid}/status")
-def update_status(bid: int, action: str = Form(...)):
-    db = SessionLocal()
-    b = db.query(Booking).get(bid)
+async def update_status(bid: int, action: str = Form(...), db: AsyncSession = Depends(get_db)):
+    b = await db.get(Booking, bid)
     if not b:
-        db.close(); return RedirectResponse("/", status_code=303)
-    if action == "done":
-        b.status = "Done"; b.fee_jpy = b.fee_jpy or 1000
-    elif action == "cancel":
-        b.status = "Cancel"
-    elif action == "book":
-        b.status = "Booked"; b.fee_jpy = None
-    db.commit(); db.close()
+        return RedirectResponse("/", status_code=303)
+    apply_status_action(b, action)
+    try:
+        await db.commit()
+    except IntegrityError:  # Cancel からの復帰が既存予約と重なる（Postgres）
+        await db.rollback()
     return RedirectResponse("/", status_code=303)
 
 @app.get("/export.csv")
-def export_csv():
-    db = SessionLocal(); rows = db.query(Booking).order_by(Booking.start_at.desc()).all(); db.close()
-    buf = io.StringIO(); w = csv.writer(buf)
-    w.writerow(["id","name","start_at","end_at","minutes","status","fee_jpy","memo","created_at"])
-    for r in rows:
-        w.writerow([
-            r.id, r.name,
-            _to_aware_jst(r.start_at).isoformat(),
-            _to_aware_jst(r.end_at).isoformat(),
-            r.minutes, r.status, r.fee_jpy or "", r.memo or "",
-            _to_aware_jst(r.created_at).isoformat() if r.created_at else ""
-        ])
-    buf.seek(0)
-    return StreamingResponse(iter([buf.getvalue()]), media_type="text/csv",
+async def export_csv():
+    async def rows_csv():
+        # 1 行分だけのバッファを使い回して、全件を溜めずに流す
+        buf = io.StringIO(); w = csv.writer(buf)
+        def line(values) -> str:
+            buf.seek(0); buf.truncate()
+            w.writerow(values)
+            return buf.getvalue()
+
+        yield line(["id","name","start_at","end_at","minutes","status","fee_jpy","memo","created_at"])
+        # レスポンス送信中もカーソルを使うので、セッションはジェネレータ内で開閉する
+        async with SessionLocal() as db:
+            result = await db.stream(
+                select(*BOOKING_COLS, Booking.created_at)
+                .order_by(Booking.start_at.desc()).execution_options(yield_per=1000)
+            )
+            async for r in result:
+                yield line([
+                    r.id, r.name,
+                    r.start_at.isoformat(),
+                    r.end_at.isoformat(),
+                    r.minutes, r.status, r.fee_jpy or "", r.memo or "",
+                    r.created_at.isoformat() if r.created_at else ""
+                ])
+    return StreamingResponse(rows_csv(), media_type="text/csv",
         headers={"Content-Disposition": "attachment; filename=bookings.csv"})
 
 
 # ---------------- 登録名 API ----------------
 @app.get("/api/names", response_model=List[str])
-def api_list_names():
-    db = SessionLocal()
-    names = [r.name for r in db.query(RegisteredName).order_by(RegisteredName.name).all()]
-    db.close()
+async def api_list_names(db: AsyncSession = Depends(get_db)):
+    names = (await db.scalars(select(RegisteredName.name).order_by(RegisteredName.name))).all()
     return names
 
 
@@ -261,18 +569,15 @@ class NameIn(BaseModel):
 
 
 @app.post("/api/names", status_code=201)
-def api_register_name(payload: NameIn):
+async def api_register_name(payload: NameIn, db: AsyncSession = Depends(get_db)):
     name = payload.name.strip()
     if not name:
         raise HTTPException(status_code=400, detail="Name is required.")
-    db = SessionLocal()
-    if db.query(RegisteredName).filter(RegisteredName.name == name).first():
-        db.close()
+    if await db.scalar(select(RegisteredName.id).where(RegisteredName.name == name)):
         raise HTTPException(status_code=409, detail="Name already registered.")
     rn = RegisteredName(name=name)
     db.add(rn)
-    db.commit()
-    db.close()
+    await db.commit()
     return {"name": name}
 
 
@@ -285,6 +590,8 @@ class BookingIn(BaseModel):
     memo: Optional[str] = ""
 
 class BookingOut(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
     id: int
     name: str
     start_at: datetime
@@ -297,89 +604,122 @@ class BookingOut(BaseModel):
 class StatusIn(BaseModel):
     action: str  # "book" | "done" | "cancel"
 
+class BulkOpIn(BaseModel):
+    id: int
+    action: str  # "book" | "done" | "cancel" | "delete"
+
 @app.get("/api/bookings", response_model=List[BookingOut])
-def api_list_bookings(
+async def api_list_bookings(
+    request: Request,
     fr: Optional[datetime] = None,
     to: Optional[datetime] = None,
     status_eq: Optional[str] = None,
     limit: int = 50,
     offset: int = 0,
+    db: AsyncSession = Depends(get_db),
 ):
-    db = SessionLocal()
-    q = db.query(Booking)
-    if fr: q = q.filter(Booking.start_at >= fr)
-    if to: q = q.filter(Booking.start_at <= to)
-    if status_eq: q = q.filter(Booking.status == status_eq)
-    rows = q.order_by(Booking.start_at.asc()).limit(limit).offset(offset).all()
-    db.close()
-    return [
-        BookingOut(
-            id=r.id, name=r.name,
-            start_at=_to_aware_jst(r.start_at), end_at=_to_aware_jst(r.end_at),
-            minutes=r.minutes, status=r.status, fee_jpy=r.fee_jpy, memo=r.memo
-        ) for r in rows
-    ]
+    # 同じ URL で版が変わっていなければ 304（Streamlit の再取得を空レスポンスで済ませる）
+    etag = f'"{await bookings_version(db)}"'
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    q = select(*BOOKING_COLS)
+    if fr: q = q.where(Booking.start_at >= fr)
+    if to: q = q.where(Booking.start_at <= to)
+    if status_eq: q = q.where(Booking.status == status_eq)
+    rows = (await db.execute(q.order_by(Booking.start_at.asc()).limit(limit).offset(offset))).all()
+    # DB の値をそのまま dict で返す（response_model の検証を通さず orjson で直接シリアライズ）
+    return ORJSONResponse([r._asdict() for r in rows], headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.get("/api/bookings/ndjson")
+async def api_stream_bookings(
+    request: Request,
+    fr: Optional[datetime] = None,
+    to: Optional[datetime] = None,
+    status_eq: Optional[str] = None,
+    db: AsyncSession = Depends(get_db),
+):
+    """/api/bookings と同じ条件で、1 行 1 予約の NDJSON を流す（月次の Done 取得用。件数上限なし）"""
+    etag = f'"{await bookings_version(db)}"'
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    q = select(*BOOKING_COLS)
+    if fr: q = q.where(Booking.start_at >= fr)
+    if to: q = q.where(Booking.start_at <= to)
+    if status_eq: q = q.where(Booking.status == status_eq)
+
+    async def rows_ndjson():
+        # export.csv と同じく、送信中もカーソルを使うのでセッションはジェネレータ内で開閉する
+        async with SessionLocal() as db:
+            result = await db.stream(q.order_by(Booking.start_at.asc()).execution_options(yield_per=500))
+            async for r in result:
+                yield orjson.dumps(r._asdict()) + b"\n"
+    return StreamingResponse(rows_ndjson(), media_type="application/x-ndjson",
+                             headers={"ETag": etag, "Cache-Control": "no-cache"})
 
 @app.post("/api/bookings", response_model=BookingOut, status_code=201)
-def api_create_booking(payload: BookingIn):
-    parts = payload.start_time.split(":")
-    h = int(parts[0]); m = int(parts[1]) if len(parts) > 1 else 0
-    s = dt_merge(payload.start_date, time(h, m)); e = s + timedelta(minutes=payload.minutes)
+async def api_create_booking(payload: BookingIn, background_tasks: BackgroundTasks,
+                             db: AsyncSession = Depends(get_db)):
+    s = dt_merge(payload.start_date, parse_start_time(payload.start_time))
+    e = s + timedelta(minutes=payload.minutes)
 
     # 過去禁止（API でも明示）
     if s < datetime.now(JST):
         raise HTTPException(status_code=400, detail="Cannot create booking in the past.")
 
-    db = SessionLocal()
-    exists = db.query(Booking).filter(Booking.status != "Cancel").all()
-    for b in exists:
-        if overlaps(b.start_at, b.end_at, s, e):
-            db.close()
-            raise HTTPException(status_code=409, detail="Time slot overlaps an existing booking.")
+    await begin_booking_write(db)
+    if await find_conflict(db, s, e):
+        raise HTTPException(status_code=409, detail="Time slot overlaps an existing booking.")
     bk = Booking(name=payload.name.strip(), start_at=s, end_at=e, minutes=payload.minutes, memo=payload.memo or "")
     db.add(bk)
-    db.commit()
-    db.refresh(bk)
-    # セッションを閉じる前に bk の値を退避（DetachedInstanceError 防止）
-    bk_id, bk_name, bk_start, bk_end = bk.id, bk.name, bk.start_at, bk.end_at
-    bk_minutes, bk_status, bk_fee, bk_memo = bk.minutes, bk.status, bk.fee_jpy, bk.memo
-    ensure_name_registered(db, payload.name)
-    db.close()
-
-    subj = f"【予約】{bk_start.strftime('%Y/%m/%d %H:%M')} {bk_name}"
-    body = f"{bk_name}\n{bk_start.strftime('%Y/%m/%d %H:%M')} - {bk_end.strftime('%H:%M')}（{payload.minutes}分）\n{payload.memo or ''}"
+    db.add(OutboxNotification(
+        subject=f"【予約】{fmt_dt(s)} {bk.name}",
+        body=f"{bk.name}\n{fmt_dt(s)} - {fmt_t(e)}（{payload.minutes}分）\n{payload.memo or ''}",
+    ))
     try:
-        asyncio.get_running_loop().create_task(notify(subj, body))
-    except RuntimeError:
-        asyncio.run(notify(subj, body))
+        await db.commit()
+    except IntegrityError:  # 排他制約（Postgres）に弾かれた＝同時作成の競合
+        raise HTTPException(status_code=409, detail="Time slot overlaps an existing booking.")
+    await db.refresh(bk)
+    await ensure_name_registered(db, payload.name)
+    background_tasks.add_task(drain_outbox)
 
-    return BookingOut(
-        id=bk_id, name=bk_name, start_at=bk_start, end_at=bk_end,
-        minutes=bk_minutes, status=bk_status, fee_jpy=bk_fee, memo=bk_memo
-    )
+    return BookingOut.model_validate(bk)
 
 @app.post("/api/bookings/{bid}/status", response_model=BookingOut)
-def api_update_status(bid: int, payload: StatusIn):
-    db = SessionLocal(); b = db.query(Booking).get(bid)
+async def api_update_status(bid: int, payload: StatusIn, db: AsyncSession = Depends(get_db)):
+    b = await db.get(Booking, bid)
     if not b:
-        db.close(); raise HTTPException(404, "Booking not found")
-    if payload.action == "done":
-        b.status = "Done"; b.fee_jpy = b.fee_jpy or 1000
-    elif payload.action == "cancel":
-        b.status = "Cancel"
-    elif payload.action == "book":
-        b.status = "Booked"; b.fee_jpy = None
-    else:
-        db.close(); raise HTTPException(400, "Invalid action")
-    db.commit(); db.refresh(b); db.close()
-    return BookingOut(
-        id=b.id, name=b.name,
-        start_at=_to_aware_jst(b.start_at), end_at=_to_aware_jst(b.end_at),
-        minutes=b.minutes, status=b.status, fee_jpy=b.fee_jpy, memo=b.memo
-    )
+        raise HTTPException(404, "Booking not found")
+    if not apply_status_action(b, payload.action):
+        raise HTTPException(400, "Invalid action")
+    try:
+        await db.commit()
+    except IntegrityError:  # Cancel からの復帰が既存予約と重なる（Postgres）
+        raise HTTPException(409, "Time slot overlaps an existing booking.")
+    await db.refresh(b)
+    return BookingOut.model_validate(b)
+
+@app.post("/api/bookings/bulk_status")
+async def api_bulk_status(ops: List[BulkOpIn], db: AsyncSession = Depends(get_db)):
+    """複数の状態変更・削除を 1 トランザクションでまとめて反映する（全部成功するか、何も変えない）"""
+    found = {b.id: b for b in (await db.scalars(select(Booking).where(Booking.id.in_({op.id for op in ops})))).all()}
+    deleted = set()
+    for op in ops:
+        b = found.get(op.id)
+        if not b or op.id in deleted:
+            raise HTTPException(404, f"Booking not found: {op.id}")
+        if op.action == "delete":
+            await db.delete(b); deleted.add(op.id)
+        elif not apply_status_action(b, op.action):
+            raise HTTPException(400, f"Invalid action: {op.action}")
+    try:
+        await db.commit()
+    except IntegrityError:  # Cancel からの復帰が既存予約と重なる（Postgres）
+        raise HTTPException(409, "Time slot overlaps an existing booking.")
+    return {"applied": len(ops)}
 
 @app.get("/api/stats/monthly")
-def api_stats_monthly(year: int, month: int):
+async def api_stats_monthly(year: int, month: int, db: AsyncSession = Depends(get_db)):
     # 月初〜月末（JST）
     start = datetime(year, month, 1, 0, 0, tzinfo=JST)
     if month == 12:
@@ -387,42 +727,28 @@ def api_stats_monthly(year: int, month: int):
     else:
         end = datetime(year, month+1, 1, 0, 0, tzinfo=JST) - timedelta(seconds=1)
 
-    db = SessionLocal()
-    rows = (db.query(
-                func.count(Booking.id).label("done_count"),
-                func.coalesce(func.sum(Booking.fee_jpy), 0).label("total_fee")
-            )
-            .filter(Booking.status == "Done")
-            .filter(Booking.start_at >= start)
-            .filter(Booking.start_at <= end)
-            .one())
-    db.close()
+    rows = (await db.execute(
+        select(
+            func.count().label("done_count"),
+            func.coalesce(func.sum(Booking.fee_jpy), 0).label("total_fee")
+        )
+        .where(Booking.status == "Done")
+        .where(Booking.start_at >= start)
+        .where(Booking.start_at <= end)
+    )).one()
     return {"year": year, "month": month, "done_count": rows.done_count, "total_fee": rows.total_fee}
 
 @app.delete("/api/bookings/{bid}", status_code=204)
-def api_delete_booking(bid: int):
+async def api_delete_booking(bid: int, db: AsyncSession = Depends(get_db)):
     """予約を完全削除する"""
-    db = SessionLocal()
-    b = db.query(Booking).get(bid)
+    b = await db.get(Booking, bid)
     if not b:
-        db.close()
         raise HTTPException(status_code=404, detail="Booking not found")
-    db.delete(b)
-    db.commit()
-    db.close()
+    await db.delete(b)
+    await db.commit()
     return  # 204 No Content
 
-# --- DBモデル ---
-class Feedback(Base):
-    __tablename__ = "feedbacks"
-    id = Column(Integer, primary_key=True, autoincrement=True)
-    text = Column(Text, nullable=False)
-    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(JST))
-
-Base.metadata.create_all(engine)
-
-# --- API ---
-from pydantic import BaseModel
+# ---------------- 要望 API ----------------
 class FeedbackIn(BaseModel):
     text: str
 
@@ -432,21 +758,17 @@ class FeedbackOut(BaseModel):
     created_at: datetime
 
 @app.post("/api/feedback", response_model=FeedbackOut, status_code=201)
-def api_create_feedback(payload: FeedbackIn):
-    db = SessionLocal()
+async def api_create_feedback(payload: FeedbackIn, db: AsyncSession = Depends(get_db)):
     fb = Feedback(text=payload.text)
     db.add(fb)
-    db.commit()
-    db.refresh(fb)
-    db.close()
-    return FeedbackOut(id=fb.id, text=fb.text, created_at=_to_aware_jst(fb.created_at))
+    await db.commit()
+    await db.refresh(fb)
+    return FeedbackOut(id=fb.id, text=fb.text, created_at=fb.created_at)
 
 @app.get("/api/feedback", response_model=List[FeedbackOut])
-def api_list_feedback():
-    db = SessionLocal()
-    rows = db.query(Feedback).order_by(Feedback.created_at.desc()).all()
-    db.close()
+async def api_list_feedback(db: AsyncSession = Depends(get_db)):
+    rows = (await db.scalars(select(Feedback).order_by(Feedback.created_at.desc()))).all()
     return [
-        FeedbackOut(id=r.id, text=r.text, created_at=_to_aware_jst(r.created_at))
+        FeedbackOut(id=r.id, text=r.text, created_at=r.created_at)
         for r in rows
     ]
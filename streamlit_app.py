@@ -1,13 +1,18 @@
 # streamlit_app.py
-import os, requests, datetime as dt
+import os, requests, tempfile, time, datetime as dt
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import base64
+import orjson
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import streamlit as st
-from math import ceil
+from diskcache import Cache
 
 # 追加：Doneを日別に色付けして表示するカレンダー
 import calendar
 
+@st.cache_resource
 def _load_stamp_base64():
     """ハンコ用の島画像を base64 で読み込む（キャッシュ）"""
     path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static", "shima_meiso.png")
@@ -16,30 +21,10 @@ def _load_stamp_base64():
             return base64.b64encode(f.read()).decode("utf-8")
     return None
 
-def render_done_calendar(year: int, month: int, rows: list[dict]):
-    """
-    rows: /api/bookings で取得した Done の予約（start_at を含む）
-    同日内に1件でも Done があれば、その日のセルを緑でハイライト。
-    セル内に 件数・合計金額・島画像ハンコを表示。
-    """
-    stamp_b64 = _load_stamp_base64()
-
-    # 日別の件数と金額集計
-    day_count = {}
-    day_sum = {}
-    for r in rows:
-        d = pd.to_datetime(r["start_at"]).date()
-        if d.year == year and d.month == month:
-            day_count[d.day] = day_count.get(d.day, 0) + 1
-            if r.get("fee_jpy"):
-                day_sum[d.day] = day_sum.get(d.day, 0) + int(r["fee_jpy"])
-
-    cal = calendar.Calendar(firstweekday=6)  # 日曜始まり
-    weeks = cal.monthdayscalendar(year, month)  # [[日, 月, 火, 水, 木, 金, 土], ...]
-    weekdays_ja = ["日", "月", "火", "水", "木", "金", "土"]
-
-    # スタイル（ハンコ画像用追加）
-    css = """
+@st.cache_resource
+def _calendar_css():
+    """カレンダー用スタイル（ハンコ画像用追加）"""
+    return """
     <style>
       .cal { width: 100%; border-collapse: collapse; table-layout: fixed; }
       .cal th, .cal td { border: 1px solid #ddd; vertical-align: top; padding: 6px; height: 92px; }
@@ -54,31 +39,44 @@ def render_done_calendar(year: int, month: int, rows: list[dict]):
     </style>
     """
 
-    # HTML組み立て
-    html = ['<table class="cal">']
-    html.append("<tr>" + "".join(f"<th>{w}</th>" for w in weekdays_ja) + "</tr>")
-    for w in weeks:
-        html.append("<tr>")
-        for day in w:
-            if day == 0:
-                html.append('<td class="empty"></td>')
-                continue
-            classes = []
-            if day in day_count:
-                classes.append("done")
-            c = " ".join(classes)
-            cnt = day_count.get(day, 0)
-            sm  = day_sum.get(day, 0)
-            badge = f'<div class="count">{cnt} 件</div>' if cnt else ""
-            yen   = f'<span class="sum">¥{sm:,}</span>' if sm else ""
-            stamp = ""
-            if day in day_count and stamp_b64:
-                stamp = f'<div class="stamp-wrap"><img class="stamp-img" src="data:image/png;base64,{stamp_b64}" alt="済" /></div>'
-            html.append(f'<td class="{c}"><span class="daynum">{day}</span>{badge}{yen}{stamp}</td>')
-        html.append("</tr>")
-    html.append("</table>")
-
-    st.markdown(css + "\n" + "\n".join(html), unsafe_allow_html=True)
+# カレンダーの表頭（曜日行）は固定なので1回だけ組み立てる
+_CAL_HEADER = '<table class="cal">\n<tr>' + "".join(f"<th>{w}</th>" for w in ["日", "月", "火", "水", "木", "金", "土"]) + "</tr>"
+
+def render_done_calendar(year: int, month: int, rows: list[dict]):
+    """
+    rows: fetch_done_by_day で取得した Done の予約（パース済みの _start を含む）
+    同日内に1件でも Done があれば、その日のセルを緑でハイライト。
+    セル内に 件数・合計金額・島画像ハンコを表示。
+    """
+    stamp_b64 = _load_stamp_base64()
+
+    # 日別の件数と金額集計（pandas の groupby でまとめて計算）
+    df = pd.DataFrame(rows, columns=["id", "fee_jpy", "_start"])
+    start = pd.to_datetime(df["_start"])
+    in_month = (start.dt.year == year) & (start.dt.month == month)
+    agg = df[in_month].groupby(start[in_month].dt.day).agg(cnt=("id", "size"), sm=("fee_jpy", "sum"))
+    day_count = {int(d): int(c) for d, c in agg["cnt"].items()}
+    day_sum = {int(d): int(v) for d, v in agg["sm"].items() if v}
+
+    cal = calendar.Calendar(firstweekday=6)  # 日曜始まり
+    weeks = cal.monthdayscalendar(year, month)  # [[日, 月, 火, 水, 木, 金, 土], ...]
+
+    # HTML組み立て（1回の join でまとめて生成）
+    stamp = (f'<div class="stamp-wrap"><img class="stamp-img" src="data:image/png;base64,{stamp_b64}" alt="済" /></div>'
+             if stamp_b64 else "")
+    badge = {d: f'<div class="count">{c} 件</div>' for d, c in day_count.items()}
+    yen = {d: f'<span class="sum">¥{v:,}</span>' for d, v in day_sum.items()}
+    rows_html = "\n".join(
+        "<tr>" + "".join(
+            '<td class="empty"></td>' if day == 0 else
+            f'<td class="{"done" if day in day_count else ""}"><span class="daynum">{day}</span>'
+            f'{badge.get(day, "")}{yen.get(day, "")}{stamp if day in day_count else ""}</td>'
+            for day in w
+        ) + "</tr>"
+        for w in weeks
+    )
+
+    st.markdown(_CAL_HEADER + "\n" + rows_html + "\n</table>", unsafe_allow_html=True)
 
 
 # ===== 設定 =====
@@ -90,10 +88,13 @@ st.set_page_config(
     page_icon="static/shima_meiso.png",    # 例: プロジェクト直下/static/favicon.png
     layout="centered"
 )
+st.markdown(_calendar_css(), unsafe_allow_html=True)
+
 # 例：streamlit_app.py のタイトル部分を置き換え
 col_icon, col_title = st.columns([1, 6])
 
 with col_icon:
+    # st.image はメディア URL だけを送る（ブラウザ側でキャッシュされる）。base64 で埋め込むと毎回数 MB になる
     st.image("static/shima_meiso.png", width=100)   # ← ここにアイコン画像のパス
 
 with col_title:
@@ -101,16 +102,128 @@ with col_title:
 
 
 # ---- セッション & 共通関数 ----
-_session = requests.Session()
-
-@st.cache_data(ttl=5)
-def fetch_bookings(params: dict):
-    """FastAPI /api/bookings を叩いて予約JSONを返す（5秒キャッシュ）"""
-    r = _session.get(f"{BACKEND}/api/bookings", params=params, timeout=10)
+@st.cache_resource
+def _get_session() -> requests.Session:
+    """HTTP セッション（再実行のたびに作り直さず、プロセスで 1 つを keep-alive で使い回す）"""
+    s = requests.Session()
+    # 接続プールを広げ、バックエンド再起動中などの 502/503/504 は GET のみ軽くリトライ
+    # （urllib3 の既定は PUT / DELETE も再送するので明示的に絞る）
+    adapter = HTTPAdapter(
+        pool_connections=10, pool_maxsize=20,
+        max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=[502, 503, 504],
+                          allowed_methods=["GET"]),
+    )
+    s.mount("http://", adapter)
+    s.mount("https://", adapter)
+    return s
+
+_session = _get_session()
+_JSON_HEADERS = {"Content-Type": "application/json"}  # POST 本文は orjson でエンコードして送る
+
+@st.cache_resource
+def _etag_store() -> dict:
+    """params_key → (ETag, 前回の JSON)。304 が返ったときに前回の本文を使い回す"""
+    return {}
+
+@st.cache_resource
+def _disk_cache() -> Cache:
+    """過去期間の (ETag, JSON) と先月までの Done 日別バケツを置くディスクキャッシュ（Streamlit の再起動をまたいで残る）"""
+    return Cache(os.getenv("PILATES_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pilates_cache")))
+
+PAST_RANGE_EXPIRE_SEC = 30 * 24 * 3600
+
+def _is_past_range(params: dict) -> bool:
+    """期間の終わりが今日より前なら、再起動後もディスクの本文を ETag で再検証して使い回す"""
+    to = params.get("to")
+    return bool(to) and dt.datetime.fromisoformat(to) < dt.datetime.combine(dt.date.today(), dt.time.min)
+
+def _get_bookings_json(params_key: tuple) -> list:
+    """/api/bookings を ETag 付きで取得する（304 なら前回の本文）。
+    過去期間はディスクにも (ETag, 本文) を残すが、使う前に必ず If-None-Match で再検証する
+    （Web 画面や別プロセスからの状態変更も 200 で取り直せる）
+    """
+    store = _etag_store()
+    past = _is_past_range(dict(params_key))
+    disk_key = ("bookings", params_key)
+    cached = store.get(params_key) or (_disk_cache().get(disk_key) if past else None)
+    headers = {"If-None-Match": cached[0]} if cached else {}
+    r = _session.get(f"{BACKEND}/api/bookings", params=dict(params_key), headers=headers, timeout=10)
+    if r.status_code == 304:
+        return cached[1]
     r.raise_for_status()
-    data = r.json()
-    data.sort(key=lambda x: x["start_at"])
-    return data
+    raw = orjson.loads(r.content)
+    if "ETag" in r.headers:
+        if len(store) >= 100:  # 条件の組み合わせが増えすぎたら捨てる
+            store.clear()
+        store[params_key] = (r.headers["ETag"], raw)
+        if past:
+            _disk_cache().set(disk_key, store[params_key], expire=PAST_RANGE_EXPIRE_SEC)
+    return raw
+
+@st.cache_data(ttl=60)
+def fetch_bookings(params_key: tuple):
+    """FastAPI /api/bookings を叩いて予約JSONを返す（60秒キャッシュ + ETag で再検証。過去期間はディスクにも残す）
+    params_key: tuple(sorted(params.items()))。並び順が違うだけの同じ条件を同じキャッシュに当てる
+    """
+    raw = _get_bookings_json(params_key)
+    return [dict(d) for d in raw]  # 保存した本文は書き換えない（並びは API 側で start_at 昇順）
+
+
+DAY_CACHE_TTL_SEC = 60
+
+def _fetch_done_span(first: dt.date, last: dt.date, etag: str = ""):
+    """/api/bookings/ndjson から first〜last の Done を 1 行ずつ読み、届いた順に日ごとのバケツに振り分ける
+    （一覧全体をバッファしない）。etag を渡して 304 なら None、それ以外は (ETag, {date: [row, ...]})
+    """
+    params = {
+        "fr": dt.datetime.combine(first, dt.time.min).isoformat(),
+        "to": dt.datetime.combine(last, dt.time.max).isoformat(),
+        "status_eq": "Done",
+    }
+    headers = {"If-None-Match": etag} if etag else {}
+    with _session.get(f"{BACKEND}/api/bookings/ndjson", params=params, headers=headers,
+                      stream=True, timeout=10) as r:
+        if r.status_code == 304:
+            return None
+        r.raise_for_status()
+        by_day = {}
+        for line in r.iter_lines():
+            if not line:
+                continue
+            d = orjson.loads(line)
+            d["_start"] = dt.datetime.fromisoformat(d["start_at"])  # 日ごとの振り分けとカレンダー集計で使う
+            by_day.setdefault(d["_start"].date(), []).append(d)
+        return r.headers.get("ETag"), by_day
+
+def fetch_done_by_day(year: int, month: int) -> list[dict]:
+    """その月の Done 予約を日単位のキャッシュから組み立てる。
+    キャッシュにない日（今月以降の日は 60 秒で期限切れ）をまとめた 1 区間だけ NDJSON で流してもらう。
+    今月の昨日以前も後から Done にされるので、期限なしで持つのは先月までの日だけ。
+    先月までの日はディスクにも (ETag, 行) を日付キーで残し、再起動後は If-None-Match で再検証して使い回す。
+    """
+    cache = st.session_state.setdefault("day_cache", {})  # date -> (取得時刻, [row, ...])
+    month_start = dt.date.today().replace(day=1)
+    now = time.monotonic()
+    days = [dt.date(year, month, d) for d in range(1, calendar.monthrange(year, month)[1] + 1)]
+    missing = [d for d in days
+               if d not in cache or (d >= month_start and now - cache[d][0] > DAY_CACHE_TTL_SEC)]
+    if missing:
+        span = days[days.index(missing[0]):days.index(missing[-1]) + 1]
+        past = span[-1] < month_start
+        stored = [_disk_cache().get(("done_day", d)) for d in span] if past else []
+        # 同じ取得で保存した日（ETag が揃っている）なら条件付きで取りに行く
+        etag = stored[0][0] if stored and all(x and x[0] == stored[0][0] for x in stored) else None
+        got = _fetch_done_span(missing[0], missing[-1], etag)
+        if got is None:  # 304: ディスクの日別バケツがそのまま使える
+            by_day = {d: x[1] for d, x in zip(span, stored)}
+        else:
+            etag, by_day = got
+            if past and etag:
+                for d in span:
+                    _disk_cache().set(("done_day", d), (etag, by_day.get(d, [])), expire=PAST_RANGE_EXPIRE_SEC)
+        for d in span:  # 件数上限がないので、取得した区間は常に完全
+            cache[d] = (now, by_day.get(d, []))
+    return [r for d in days for r in cache[d][1]]
 
 
 @st.cache_data(ttl=30)
@@ -118,74 +231,104 @@ def fetch_registered_names():
     """登録済み名前一覧を取得"""
     r = _session.get(f"{BACKEND}/api/names", timeout=10)
     r.raise_for_status()
-    return r.json()
+    return orjson.loads(r.content)
+
+# ステータスの表示バッジ（カードごとに作り直さない）
+_BADGES = {"Booked": "🔵 Booked", "Done": "🟢 Done", "Cancel": "🔴 Cancel"}
+
+def _build_card_strings(bid, start_iso, end_iso, minutes, name, memo, status_val, fee) -> dict:
+    """カードの表示文字列（cache_data だと引数のハッシュと pickle 復元の方が重いので毎回作る）"""
+    start = dt.datetime.fromisoformat(start_iso)
+    end   = dt.datetime.fromisoformat(end_iso)
+    return {
+        "id": f"**#{bid}**",
+        "date_str": start.strftime("%Y/%m/%d"),
+        "time_range": f"🕒 **{start.strftime('%H:%M')} – {end.strftime('%H:%M')}**",
+        "minutes": f"{int(minutes)} 分",
+        "name": f"👤 **{name}**",
+        "memo": f"📝 {memo}" if memo else "",
+        "badge": _BADGES.get(status_val, f"🔘 {status_val}"),
+        "fee_str": f"¥{fee:,}" if fee else "",
+    }
+
+# カードで選べる操作（API の action → 表示名）
+_ACTION_LABELS = {"done": "Done", "book": "Booked", "delete": "🗑 Delete"}
 
 def render_booking_card(row: dict, key_prefix: str = ""):
-    """一覧カード（Done / Booked / Delete を縦配置）"""
+    """一覧カード（Done / Booked / Delete を選んで保留に積む）"""
     bid = row["id"]
-    start = pd.to_datetime(row["start_at"])
-    end   = pd.to_datetime(row["end_at"])
-    name  = row["name"]
-    memo  = row.get("memo") or ""
-    status_val = row["status"]
-    fee = row.get("fee_jpy")
+    kp = (key_prefix + "-") if key_prefix else ""  # prefix を key に付ける（'' ならそのまま）
+    pending = st.session_state.setdefault("pending_ops", {})  # {id: action}
+    c = _build_card_strings(bid, row["start_at"], row["end_at"], row["minutes"], row["name"],
+                            row.get("memo") or "", row["status"], row.get("fee_jpy"))
 
     with st.container(border=True):
         cols = st.columns([1, 2, 3, 1.6, 1.0], gap="small")
 
         with cols[0]:
-            st.markdown(f"**#{bid}**")
-            st.caption(start.strftime("%Y/%m/%d"))
+            st.markdown(c["id"])
+            st.caption(c["date_str"])
 
         with cols[1]:
-            st.markdown(f"🕒 **{start.strftime('%H:%M')} – {end.strftime('%H:%M')}**")
-            st.caption(f"{int(row['minutes'])} 分")
+            st.markdown(c["time_range"])
+            st.caption(c["minutes"])
 
         with cols[2]:
-            st.markdown(f"👤 **{name}**")
-            if memo:
-                st.caption(f"📝 {memo}")
+            st.markdown(c["name"])
+            if c["memo"]:
+                st.caption(c["memo"])
 
         with cols[3]:
-            badge = {"Booked":"🔵 Booked", "Done":"🟢 Done", "Cancel":"🔴 Cancel"}.get(status_val, f"🔘 {status_val}")
-            st.markdown(badge)
-            if fee:
-                st.caption(f"¥{fee:,}")
+            st.markdown(c["badge"])
+            if c["fee_str"]:
+                st.caption(c["fee_str"])
+            if bid in pending:
+                st.caption(f"⏳ {_ACTION_LABELS[pending[bid]]}（未反映）")
 
         with cols[4]:
-            # prefix を key に付ける（'' ならそのまま）
-            kp = (key_prefix + "-") if key_prefix else ""
-
-            if st.button("Done",   key=f"{kp}done-{bid}",   use_container_width=True):
-                rr = _session.post(f"{BACKEND}/api/bookings/{bid}/status", json={"action":"done"}, timeout=10)
-                (st.success if rr.ok else st.error)("Done にしました" if rr.ok else f"更新失敗: {rr.status_code} {rr.text}")
-                st.cache_data.clear(); st.rerun()
-
-            if st.button("Booked", key=f"{kp}book-{bid}",   use_container_width=True):
-                rr = _session.post(f"{BACKEND}/api/bookings/{bid}/status", json={"action":"book"}, timeout=10)
-                (st.success if rr.ok else st.error)("Booked に戻しました" if rr.ok else f"更新失敗: {rr.status_code} {rr.text}")
-                st.cache_data.clear(); st.rerun()
-
-            if st.button("🗑 Delete", key=f"{kp}del-{bid}", use_container_width=True):
-                rr = _session.delete(f"{BACKEND}/api/bookings/{bid}", timeout=10)
-                if rr.status_code == 204:
-                    st.success("削除しました")
-                    st.cache_data.clear(); st.rerun()
-                else:
-                    st.error(f"削除失敗: {rr.status_code} {rr.text}")
+            # 操作はその場で送らず保留に積む（「変更を反映」でまとめて 1 回送る）
+            with st.form(f"{kp}card-{bid}", clear_on_submit=True, border=False):
+                label = st.radio("操作", list(_ACTION_LABELS.values()), key=f"{kp}act-{bid}",
+                                 label_visibility="collapsed")
+                if st.form_submit_button("選択", use_container_width=True):
+                    pending[bid] = next(a for a, l in _ACTION_LABELS.items() if l == label)
+                    st.rerun()
+
+def render_pending_bar():
+    """保留中の操作があれば、まとめて反映 / 取り消しするボタンを出す"""
+    pending = st.session_state.setdefault("pending_ops", {})
+    if not pending:
+        return
+    c1, c2 = st.columns([3, 1])
+    with c1:
+        if st.button(f"変更を反映（{len(pending)} 件）", type="primary", use_container_width=True):
+            rr = _session.post(f"{BACKEND}/api/bookings/bulk_status",
+                               data=orjson.dumps([{"id": bid, "action": a} for bid, a in pending.items()]),
+                               headers=_JSON_HEADERS, timeout=10)
+            if rr.ok:
+                pending.clear()
+                st.session_state.pop("day_cache", None)
+                fetch_bookings.clear(); st.rerun()
+            else:
+                st.error(f"反映失敗: {rr.status_code} {rr.text}")
+    with c2:
+        if st.button("取り消し", use_container_width=True):
+            pending.clear(); st.rerun()
 
 # ---- 直近15分への切り上げ ----
 def next_quarter(dt_now: dt.datetime) -> dt.datetime:
-    m = int(ceil(dt_now.minute / 15) * 15)
+    m = (dt_now.minute + 14) // 15 * 15  # 15 分単位に切り上げ（整数演算のみ）
     if m == 60:
         return dt_now.replace(minute=0, second=0, microsecond=0) + dt.timedelta(hours=1)
     return dt_now.replace(minute=m, second=0, microsecond=0)
 
-tab_new, tab_list, tab_stats, tab_feedback = st.tabs(["新規予約", "一覧操作", "月次集計", "要望リスト"])
+# st.tabs だと見えていないタブの中身も毎回実行されるので、選択中のビューだけ描画する
+view = st.radio("表示", ["新規予約", "一覧操作", "月次集計", "要望リスト"],
+                horizontal=True, key="view", label_visibility="collapsed")
 
 
 # ---------- 新規予約 ----------
-with tab_new:
+if view == "新規予約":
     try:
         registered_names = fetch_registered_names()
     except Exception:
@@ -223,7 +366,7 @@ with tab_new:
                 "memo": memo,
             }
             try:
-                r = _session.post(f"{BACKEND}/api/bookings", json=payload, timeout=10)
+                r = _session.post(f"{BACKEND}/api/bookings", data=orjson.dumps(payload), headers=_JSON_HEADERS, timeout=10)
                 if r.status_code == 201:
                     st.toast("予約できました", duration=4)
                 elif r.status_code == 409:
@@ -232,12 +375,14 @@ with tab_new:
                     st.error("過去の時刻には予約できません。")
                 else:
                     st.error(f"作成に失敗しました: {r.status_code} {r.text}")
-                st.cache_data.clear()
+                # 予約一覧と名前一覧だけ取り直す（月次の Done や要望には影響しない）
+                fetch_bookings.clear()
+                fetch_registered_names.clear()
             except Exception as e:
                 st.error(f"通信エラー: {e}")
 
 # ---------- 一覧操作 ----------
-with tab_list:
+if view == "一覧操作":
     st.subheader("予約一覧（カード表示）")
 
     # 期間指定（過去も未来も）
@@ -262,8 +407,10 @@ with tab_list:
     params["limit"]  = PAGE_SIZE
     params["offset"] = (int(page)-1) * PAGE_SIZE
 
+    render_pending_bar()
+
     try:
-        data = fetch_bookings(params)
+        data = fetch_bookings(tuple(sorted(params.items())))
         if not data:
             st.info("該当期間の予約はありません。")
         else:
@@ -273,51 +420,46 @@ with tab_list:
         st.error(f"取得エラー: {e}")
 
 # ---------- 月次集計 ----------
-with tab_stats:
+if view == "月次集計":
     today = dt.date.today()
     year = st.number_input("年", 2000, 2100, today.year, step=1)
     month = st.number_input("月", 1, 12, today.month, step=1)
 
     if st.button("集計する"):
-        # ① メトリクス（件数・合計）
-        try:
-            r = _session.get(f"{BACKEND}/api/stats/monthly",
-                             params={"year": int(year), "month": int(month)}, timeout=10)
-            if r.ok:
-                s = r.json()
-                c1, c2 = st.columns(2)
-                with c1: st.metric(label="完了数 (Done)", value=s["done_count"])
-                with c2: st.metric(label="合計 (¥)", value=s["total_fee"])
-            else:
-                st.error(f"集計失敗: {r.status_code}")
+        # ① メトリクス（件数・合計）と ② その月の Done を並行して取りに行く
+        # fetch_done_by_day は session_state / cache_data を使うのでメインスレッド側で呼ぶ
+        with ThreadPoolExecutor(max_workers=1) as ex:
+            f_stats = ex.submit(_session.get, f"{BACKEND}/api/stats/monthly",
+                                params={"year": int(year), "month": int(month)}, timeout=10)
+            try:
+                rows = fetch_done_by_day(int(year), int(month))  # 日単位キャッシュで足りない日だけ取得
+                rows_err = None
+            except Exception as e:
+                rows_err = e
+            try:
+                r = f_stats.result()
+            except Exception as e:
+                st.error(f"通信エラー: {e}")
                 st.stop()
-        except Exception as e:
-            st.error(f"通信エラー: {e}")
+
+        if r.ok:
+            s = orjson.loads(r.content)
+            c1, c2 = st.columns(2)
+            with c1: st.metric(label="完了数 (Done)", value=s["done_count"])
+            with c2: st.metric(label="合計 (¥)", value=s["total_fee"])
+        else:
+            st.error(f"集計失敗: {r.status_code}")
             st.stop()
 
-        # ② その月の Done を取得してカレンダー描画
-        start = dt.datetime(int(year), int(month), 1, 0, 0, 0)
-        nextm = dt.datetime(int(year)+1, 1, 1) if int(month) == 12 else dt.datetime(int(year), int(month)+1, 1)
-        end = nextm - dt.timedelta(seconds=1)
-
-        params = {
-            "fr": start.isoformat(),
-            "to": end.isoformat(),
-            "status_eq": "Done",
-            "limit": 500, "offset": 0
-        }
-
-        try:
-            rows = fetch_bookings(params)  # JSON list
-        except Exception as e:
-            st.error(f"取得エラー: {e}")
+        if rows_err is not None:
+            st.error(f"取得エラー: {rows_err}")
             st.stop()
 
         st.subheader(f"{year}年{month}月")
         render_done_calendar(int(year), int(month), rows)
 
 # ---------- 要望リスト ----------
-with tab_feedback:
+if view == "要望リスト":
     st.subheader("アプリへの要望を書いてください")
 
     with st.form("feedback_form"):
@@ -328,10 +470,10 @@ with tab_feedback:
             st.warning("内容を入力してください")
         else:
             try:
-                r = _session.post(f"{BACKEND}/api/feedback", json={"text": fb_text.strip()}, timeout=10)
+                r = _session.post(f"{BACKEND}/api/feedback", data=orjson.dumps({"text": fb_text.strip()}),
+                                  headers=_JSON_HEADERS, timeout=10)
                 if r.status_code == 201:
                     st.success("要望を送信しました。ありがとうございます！")
-                    st.cache_data.clear()
                 else:
                     st.error(f"送信失敗: {r.status_code} {r.text}")
             except Exception as e:
@@ -342,12 +484,12 @@ with tab_feedback:
     try:
         r = _session.get(f"{BACKEND}/api/feedback", timeout=10)
         if r.ok:
-            fb_list = r.json()
+            fb_list = orjson.loads(r.content)
             if not fb_list:
                 st.info("まだ要望はありません。")
             else:
                 for fb in fb_list:
-                    t = pd.to_datetime(fb["created_at"]).strftime("%Y/%m/%d %H:%M")
+                    t = dt.datetime.fromisoformat(fb["created_at"]).strftime("%Y/%m/%d %H:%M")
                     st.markdown(f"**{t}**  \n{fb['text']}")
         else:
             st.error(f"取得失敗: {r.status_code}")